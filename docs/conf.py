@@ -6,8 +6,6 @@ from lambdalayers.version import __version__
 # Sphinx Base --------------------------------------------------------------------------
 # Extensions
 extensions = [
-    # http://www.sphinx-doc.org/en/master/usage/extensions/autodoc.html
-    "sphinx.ext.autodoc",
     # http://www.sphinx-doc.org/en/master/usage/extensions/napoleon.html
     "sphinx.ext.napoleon",
     # http://www.sphinx-doc.org/en/master/usage/extensions/todo.html
@@ -48,14 +46,6 @@ html_short_title = "{}-{}".format(project, version)
 # Pygments Style Settings
 pygments_style = "monokai"
 
-# Sphinx Extension Autodoc -------------------------------------------------------------
-
-# Order members by source order
-autodoc_member_order = "bysource"
-
-# Always show members, and member-inheritance by default
-autodoc_default_flags = ["members", "show-inheritance"]
-
 # Sphinx Extension Napoleon ------------------------------------------------------------
 
 # We want to force google style docstrings, so disable numpy style
@@ -72,15 +62,28 @@ autoapi_dirs = ["../lambdalayers/"]
 autoapi_template_dir = "docs/autoapi_templates"
 autoapi_root = "autoapi"
 autoapi_ignore = ["*/lambdalayers/version.py", "*/lambdalayers/cli.py"]
+# Show documented public members and member-inheritance (see _skip_member below)
+autoapi_options = ["members", "show-inheritance"]
 autoapi_add_toctree_entry = False
-autoapi_keep_files = False
+# Keep the generated sources so incremental rebuilds can reuse them
+autoapi_keep_files = True
 
 # Exclude the autoapi templates in the doc building
 exclude_patterns = ["autoapi_templates"]
 
 
+def _skip_member(app, what, name, obj, skip, options):
+    # like automodule, document undocumented modules but not undocumented members
+    if what in ("package", "module") and obj.is_undoc_member:
+        return obj.is_private_member
+
+    return None
+
+
 # Add any Sphinx plugin settings here that don't have global variables exposed.
 def setup(app):
+    app.connect("autoapi-skip-member", _skip_member)
+
     # RecommonMark Settings ------------------------------------------------------------
     # Enable the evaluation of rst directive in .md files
     # https://recommonmark.readthedocs.io/en/latest/auto_structify.html
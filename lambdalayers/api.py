@@ -1,30 +1,97 @@
-import itertools
+import hashlib
 import logging
+import mmap
 import os
 import re
 import shutil
-import tempfile
+import uuid
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from io import BytesIO
 from pathlib import Path
-from typing import Any, Dict, Iterator, List, Optional, Tuple
-from zipfile import ZipFile
-
-import plz  # type: ignore
+from typing import (
+    Any,
+    BinaryIO,
+    Callable,
+    Dict,
+    FrozenSet,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    Tuple,
+    Union,
+)
+from zipfile import ZIP_DEFLATED, ZipFile, ZipInfo
 
 
 RUNTIME_VERSION_REGEX = r"^python(?P<version>\d\.\d+)$"
+_RUNTIME_VERSION_RE = re.compile(RUNTIME_VERSION_REGEX)
+
+# multi-runtime layers up to this many uncompressed bytes are merged in memory
+_IN_MEMORY_MERGE_LIMIT = 64 * 1024 * 1024
+
+# back off adaptively when AWS throttles us, e.g. when listing many regions at once
+_CLIENT_RETRIES = {"max_attempts": 10, "mode": "adaptive"}
+# clients are shared between threads, so allow more than botocore's default of 10
+_MAX_POOL_CONNECTIONS = 50
+
+# upload staged layer zips in parallel 8 MiB parts rather than buffering them whole
+_MULTIPART_THRESHOLD = 8 * 1024 * 1024
 
 
 logger = logging.getLogger(__name__)
 
 
+@lru_cache(maxsize=32)
+def _client(boto_session, service_name: str):
+    from botocore.config import Config
+
+    # building a client loads and parses the service model, so reuse them
+    config = Config(retries=_CLIENT_RETRIES, max_pool_connections=_MAX_POOL_CONNECTIONS)
+    return boto_session.client(service_name, config=config)
+
+
+def _pagination_config(
+    max_items: Optional[int], page_size: Optional[int]
+) -> Dict[str, int]:
+    config = {"MaxItems": max_items, "PageSize": page_size}
+    return {key: value for key, value in config.items() if value is not None}
+
+
+def _runtime_kwargs(runtime: Optional[str]) -> Dict[str, str]:
+    return {"CompatibleRuntime": runtime} if runtime else {}
+
+
+def _prefetched(pages: Iterable[Dict[str, Any]]) -> Iterator[Dict[str, Any]]:
+    # request the next page in the background while the caller consumes this one
+    page_iter = iter(pages)
+
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        future = executor.submit(next, page_iter, None)
+        while True:
+            page = future.result()
+            if page is None:
+                return
+
+            future = executor.submit(next, page_iter, None)
+            yield page
+
+
 def list_layers(
-    boto_session, runtime: Optional[str] = None
+    boto_session,
+    runtime: Optional[str] = None,
+    max_items: Optional[int] = None,
+    page_size: Optional[int] = None,
 ) -> Iterator[Dict[str, Any]]:
     """List Lambda layers visible from the current AWS account
 
     Args:
         boto_session: A boto3.session.Session instance
         runtime (optional): Only fetch layers which support this runtime
+        max_items (optional): Stop after fetching this many layers
+        page_size (optional): The number of layers to fetch per request
 
     Returns:
         An iterator over dicts with str keys, each representing a Lambda layer
@@ -45,20 +112,30 @@ def list_layers(
                 },
             }
     """
-    lambda_client = boto_session.client("lambda")
-    paginator = lambda_client.get_paginator("list_layers")
-    if runtime:
-        paginated = paginator.paginate(CompatibleRuntime=runtime)
-    else:
-        paginated = paginator.paginate()
-    layer_pages = map(lambda page: page["Layers"], paginated)
-    layers = itertools.chain.from_iterable(layer_pages)
+    for page in _layer_pages(boto_session, runtime, max_items, page_size):
+        yield from page
+
+
+def _layer_pages(
+    boto_session,
+    runtime: Optional[str] = None,
+    max_items: Optional[int] = None,
+    page_size: Optional[int] = None,
+) -> Iterator[List[Dict[str, Any]]]:
+    paginator = _client(boto_session, "lambda").get_paginator("list_layers")
+    config = _pagination_config(max_items, page_size)
+    paginated = paginator.paginate(PaginationConfig=config, **_runtime_kwargs(runtime))
 
-    return layers
+    for page in _prefetched(paginated):
+        yield page["Layers"]
 
 
 def list_versions(
-    boto_session, layer: str, runtime: Optional[str] = None
+    boto_session,
+    layer: str,
+    runtime: Optional[str] = None,
+    max_items: Optional[int] = None,
+    page_size: Optional[int] = None,
 ) -> Iterator[Dict[str, Any]]:
     """List versions of a Lambda layer visible from the current AWS account
 
@@ -66,6 +143,8 @@ def list_versions(
         boto_session: A boto3.session.Session instance
         layer: Layer name or ARN
         runtime (optional): Only fetch layer versions which support this runtime
+        max_items (optional): Stop after fetching this many layer versions
+        page_size (optional): The number of layer versions to fetch per request
 
     Returns:
         An iterator over dicts with str keys, each representing a Lambda layer version
@@ -81,28 +160,49 @@ def list_versions(
                 'CompatibleRuntimes': ['python3.6'],
             }
     """
-    lambda_client = boto_session.client("lambda")
-    paginator = lambda_client.get_paginator("list_layer_versions")
-    if runtime:
-        paginated = paginator.paginate(LayerName=layer, CompatibleRuntime=runtime)
-    else:
-        paginated = paginator.paginate(LayerName=layer)
-    layer_pages = map(lambda page: page["LayerVersions"], paginated)
-    layers = itertools.chain.from_iterable(layer_pages)
+    for page in _version_pages(boto_session, layer, runtime, max_items, page_size):
+        yield from page
+
+
+def _version_pages(
+    boto_session,
+    layer: str,
+    runtime: Optional[str] = None,
+    max_items: Optional[int] = None,
+    page_size: Optional[int] = None,
+) -> Iterator[List[Dict[str, Any]]]:
+    paginator = _client(boto_session, "lambda").get_paginator("list_layer_versions")
+    config = _pagination_config(max_items, page_size)
+    paginated = paginator.paginate(
+        LayerName=layer, PaginationConfig=config, **_runtime_kwargs(runtime)
+    )
 
-    return layers
+    for page in _prefetched(paginated):
+        yield page["LayerVersions"]
 
 
 def _read_local_layer(local_path: Path) -> Tuple[List[Path], Optional[Path]]:
-    layer_files = list(filter(lambda path: not path.match(".*"), local_path.glob("*")))
+    requirements_file = local_path / "requirements.txt"
+    with os.scandir(local_path) as entries:
+        layer_files = [
+            local_path / entry.name
+            for entry in entries
+            if not entry.name.startswith(".") and entry.name != "requirements.txt"
+        ]
+
+    return layer_files, requirements_file if requirements_file.is_file() else None
+
+
+@lru_cache(maxsize=8)
+def _caller_account(boto_session) -> str:
+    sts_client = _client(boto_session, "sts")
+    return sts_client.get_caller_identity()["Account"]
 
-    requirements_file: Optional[Path] = local_path / "requirements.txt"
-    if requirements_file in layer_files:
-        layer_files.remove(requirements_file)
-    else:
-        requirements_file = None
 
-    return layer_files, requirements_file
+@lru_cache(maxsize=8)
+def _caller_organization(boto_session) -> str:
+    org_client = _client(boto_session, "organizations")
+    return org_client.describe_organization()["Organization"]["Id"]
 
 
 def _permission_ids(
@@ -113,11 +213,10 @@ def _permission_ids(
     my_organization: bool,
 ) -> Tuple[str, Optional[str]]:
     if my_organization:
-        org_client = boto_session.client("organizations")
-        organization = org_client.describe_organization()["Organization"]["Id"]
-    elif my_account:
-        sts_client = boto_session.client("sts")
-        account = sts_client.get_caller_identity()["Account"]
+        organization = _caller_organization(boto_session)
+    elif my_account and not organization:
+        # the account is replaced by "*" below whenever an organization is given
+        account = _caller_account(boto_session)
 
     if organization:
         account = "*"
@@ -128,25 +227,148 @@ def _permission_ids(
     return account, organization
 
 
-def _zipfiles_equal(z1: Path, z2: Path):
-    z1_files = sorted(ZipFile(z1).infolist(), key=lambda x: x.filename)
-    z2_files = sorted(ZipFile(z2).infolist(), key=lambda x: x.filename)
+_ZipContents = FrozenSet[Tuple[Tuple[str, int, int], int]]
 
-    def zipinfo_equal(a, b):
-        if a is None or b is None:
-            return False
 
-        return (
-            a.filename == b.filename and a.file_size == b.file_size and a.CRC == b.CRC
-        )
+@lru_cache(maxsize=32)
+def _cached_zip_contents(z: Path, mtime_ns: int, size: int) -> _ZipContents:
+    with ZipFile(z) as zf:
+        entries = Counter((i.filename, i.file_size, i.CRC) for i in zf.infolist())
+
+    return frozenset(entries.items())
+
+
+def _zip_contents(z: Path) -> _ZipContents:
+    # key the cache on the file's stat so rebuilt zips are always re-read
+    stat = z.stat()
+    return _cached_zip_contents(z, stat.st_mtime_ns, stat.st_size)
+
+
+def _unlink_if_exists(path: Path):
+    try:
+        path.unlink()
+    except FileNotFoundError:
+        pass
+
+
+def _materialize(src: Path, dst_dir: Path) -> Path:
+    dst = dst_dir / src.name
+    _unlink_if_exists(dst)
+
+    try:
+        os.link(src, dst)
+    except OSError:
+        # e.g. cross-device links or filesystems without hard link support
+        shutil.copy(src, dst)
+
+    return dst
+
+
+def _relocated_zipinfo(info: ZipInfo, prefix: str) -> ZipInfo:
+    # zipfile only preserves permissions if we carry over the original attributes
+    name = info.filename
+    if name.startswith("python/"):
+        name = name[len("python/") :]
+
+    relocated = ZipInfo(prefix + name, date_time=info.date_time)
+    relocated.compress_type = info.compress_type
+    relocated.create_system = info.create_system
+    relocated.external_attr = info.external_attr
+
+    return relocated
+
+
+def _build_digest(
+    files: List[Path], requirements_file: Optional[Path], version: str
+) -> str:
+    digest = hashlib.blake2b(version.encode())
+
+    for path in sorted(files):
+        if path.is_dir():
+            paths = sorted(p for p in path.rglob("*") if p.is_file())
+        else:
+            paths = [path]
+
+        for file_path in paths:
+            stat = file_path.stat()
+            digest.update(f"{file_path}:{stat.st_size}:{stat.st_mtime_ns}\n".encode())
 
-    return all(
-        itertools.starmap(zipinfo_equal, itertools.zip_longest(z1_files, z2_files))
+    if requirements_file:
+        digest.update(requirements_file.read_bytes())
+
+    return digest.hexdigest()
+
+
+def _build_runtime_zip(
+    version_build_path: Path,
+    files: List[Path],
+    requirements_file: Optional[Path],
+    version: str,
+    reuse: bool = False,
+) -> Path:
+    # optionally skip rebuilding (and reinstalling requirements) if nothing has
+    # changed since the last build for this runtime; unpinned requirements won't be
+    # upgraded in that case
+    stamp_path = version_build_path / ".stamp"
+    digest = _build_digest(files, requirements_file, version)
+
+    try:
+        stamped_digest, stamped_zip = stamp_path.read_text().splitlines()
+    except (FileNotFoundError, ValueError):
+        pass
+    else:
+        if reuse and stamped_digest == digest and Path(stamped_zip).is_file():
+            logger.debug("Reusing the python%s layer zip from the last build", version)
+            return Path(stamped_zip)
+
+    import plz  # type: ignore
+
+    package_zip = plz.build_zip(
+        version_build_path,
+        *files,
+        requirements=requirements_file,
+        python_version=version,
+        zipped_prefix=Path("python"),
     )
+    stamp_path.write_text(f"{digest}\n{package_zip}\n")
+
+    return package_zip
 
 
+def _merge_runtime_zips(
+    dest: Union[Path, BinaryIO],
+    package_zips: List[Path],
+    runtimes: List[str],
+    compresslevel: Optional[int],
+):
+    # ZipFile only takes compresslevel from Python 3.7, so only pass it when it's set
+    zip_kwargs: Dict[str, Any] = {}
+    if compresslevel is not None:
+        zip_kwargs["compresslevel"] = compresslevel
+
+    with ZipFile(dest, "w", ZIP_DEFLATED, **zip_kwargs) as multi_z:
+        for package, runtime in zip(package_zips, runtimes):
+            prefix = f"python/lib/{runtime}/site-packages/"
+
+            with ZipFile(package, "r") as single_z:
+                for info in single_z.infolist():
+                    relocated = _relocated_zipinfo(info, prefix)
+                    if compresslevel is not None:
+                        # ZipFile.open ignores the archive's compresslevel for ZipInfos
+                        relocated._compresslevel = compresslevel  # type: ignore
+                    if info.is_dir():
+                        multi_z.writestr(relocated, b"")
+                        continue
+
+                    with single_z.open(info) as src, multi_z.open(
+                        relocated, "w"
+                    ) as dst:
+                        shutil.copyfileobj(src, dst)
+
+
+@lru_cache(maxsize=None)
 def python_version(runtime: str):
-    m = re.match(RUNTIME_VERSION_REGEX, runtime)
+    m = _RUNTIME_VERSION_RE.match(runtime)
     if m is None:
         raise ValueError(
             f"Runtime '{runtime}' invalid; must match `{RUNTIME_VERSION_REGEX}`"
@@ -156,57 +378,90 @@ def python_version(runtime: str):
 
 
 def build_layer(
-    local_path: Path, runtimes: List[str], build_path: Optional[Path] = None
+    local_path: Path,
+    runtimes: List[str],
+    build_path: Optional[Path] = None,
+    compresslevel: Optional[int] = None,
+    reuse_builds: bool = False,
 ):
     if not runtimes:
         raise ValueError("Must build for at least one Lambda runtime")
 
+    # a repeated runtime would have two threads building into the same directory
+    runtimes = list(dict.fromkeys(runtimes))
     build_path = build_path or local_path / ".build"
-
-    package_zips = []
-    for version in map(python_version, runtimes):
-        version_build_path = build_path / version
-        files, requirements_file = _read_local_layer(local_path)
-        package_zips.append(
-            plz.build_zip(
-                version_build_path,
-                *files,
-                requirements=requirements_file,
-                python_version=version,
-                zipped_prefix=Path("python"),
+    files, requirements_file = _read_local_layer(local_path)
+
+    # each runtime builds into its own directory, and the builds are dominated by
+    # pip installs, so run them concurrently
+    with ThreadPoolExecutor(max_workers=len(runtimes)) as executor:
+        futures = [
+            executor.submit(
+                _build_runtime_zip,
+                build_path / version,
+                files,
+                requirements_file,
+                version,
+                reuse_builds,
             )
-        )
+            for version in map(python_version, runtimes)
+        ]
+        package_zips = [future.result() for future in futures]
 
     if len(runtimes) == 1:
         logger.debug("Built a single-runtime layer zip")
-        return Path(shutil.copy(package_zips[0], build_path))
+        return _materialize(package_zips[0], build_path)
 
     # if the zip files are all the same, we don't need to create a multiversion zip
-    if all(map((lambda p: _zipfiles_equal(package_zips[0], p)), package_zips[1:])):
+    first_contents = _zip_contents(package_zips[0])
+    if all(_zip_contents(p) == first_contents for p in package_zips[1:]):
         logger.debug("Built a cross-compatible layer zip")
-        return Path(shutil.copy(package_zips[0], build_path))
+        return _materialize(package_zips[0], build_path)
 
     multi_path = build_path / package_zips[0].name
-    with tempfile.TemporaryDirectory(prefix="lambdalayers") as tmp_dir:
-        tmp_path = Path(tmp_dir)
-        combine_path = tmp_path / "package"
+    # the destination may be a hard link to a per-runtime zip from an earlier build
+    _unlink_if_exists(multi_path)
+
+    # merge small layers in memory to avoid the seeks zipfile makes to rewrite each
+    # entry's header after writing it
+    uncompressed_size = sum(
+        size * count
+        for package in package_zips
+        for (_, size, _), count in _zip_contents(package)
+    )
+    if uncompressed_size < _IN_MEMORY_MERGE_LIMIT:
+        buffer = BytesIO()
+        _merge_runtime_zips(buffer, package_zips, runtimes, compresslevel)
+        multi_path.write_bytes(buffer.getvalue())
+    else:
+        _merge_runtime_zips(multi_path, package_zips, runtimes, compresslevel)
 
-        # writing data from Python into a zip file with zipfile does not preserve
-        # permissions, so here we extract each zip to disk and recombine them
-        for package, runtime in zip(package_zips, runtimes):
-            extract_path = tmp_path / runtime
-            extract_path.mkdir()
-            prefix = Path("python") / "lib" / runtime / "site-packages"
+    logger.debug("Built a multi-runtime layer zip")
+    return multi_path
 
-            with ZipFile(package, "r") as single_z:
-                single_z.extractall(path=extract_path)
 
-            os.renames(extract_path / "python", combine_path / prefix)
+def _upload_package_to_s3(boto_session, package: Path, bucket: str) -> Tuple[str, str]:
+    from boto3.s3.transfer import TransferConfig
 
-        shutil.make_archive(build_path / package_zips[0].stem, "zip", combine_path)
+    key = f"lambdalayers/{uuid.uuid4().hex}/{package.name}"
+    transfer_config = TransferConfig(
+        multipart_threshold=_MULTIPART_THRESHOLD, use_threads=True
+    )
+    _client(boto_session, "s3").upload_file(
+        str(package), bucket, key, Config=transfer_config
+    )
 
-    logger.debug("Built a multi-runtime layer zip")
-    return multi_path
+    return bucket, key
+
+
+def _delete_staged_package(boto_session, bucket: str, key: str):
+    from botocore.exceptions import BotoCoreError, ClientError
+
+    # failing to clean up mustn't mask the publish result (or its error)
+    try:
+        _client(boto_session, "s3").delete_object(Bucket=bucket, Key=key)
+    except (BotoCoreError, ClientError) as e:
+        logger.warning("Failed to delete staged package s3://%s/%s: %s", bucket, key, e)
 
 
 def publish_layer(
@@ -216,8 +471,11 @@ def publish_layer(
     local_path: Path,
     build_path: Optional[Path],
     runtimes: List[str],
-    account: str,
+    account: Optional[str],
     organization: Optional[str] = None,
+    staging_bucket: Optional[str] = None,
+    reuse_builds: bool = False,
+    permission_ids: Optional[Callable[[], Tuple[str, Optional[str]]]] = None,
 ) -> Dict[str, Any]:
     """Publish a Lambda layer
 
@@ -229,10 +487,18 @@ def publish_layer(
         build_path: The location for the temporary build directory, or None
         runtimes: List of runtimes the layer version supports
         account: The account id for the account allowed to access this layer
-            version, or '*'
+            version, or '*' (ignored if permission_ids is given)
         organization (optional): The organization id for the organization
             allowed to access this layer (if this is provided, account should
             be '*')
+        staging_bucket (optional): An S3 bucket to upload the layer zip to
+            before publishing, instead of sending it inline with the request
+        reuse_builds (optional): Reuse each runtime's zip from the last build in
+            build_path if the layer's files and requirements file are unchanged
+            (unpinned requirements won't be upgraded)
+        permission_ids (optional): A callable returning the account and
+            organization to use instead of the arguments above, which is called
+            while the layer builds (e.g., to look them up from AWS)
 
     Returns:
         A dict with str keys, representing the published Lambda layer version
@@ -294,22 +560,75 @@ def publish_layer(
 
         Note that the 'Location' value is a temporary URL valid for 10 minutes
     """
-    lambda_client = boto_session.client("lambda")
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        lookup = executor.submit(permission_ids) if permission_ids else None
 
-    package = build_layer(local_path, runtimes, build_path)
+        package = build_layer(
+            local_path, runtimes, build_path, reuse_builds=reuse_builds
+        )
+        logger.info("Built package for %s at %s", layer, package)
+
+        if lookup:
+            account, organization = lookup.result()
 
-    logger.info(f"Built package for {layer} at {package}")
+    if not account:
+        raise ValueError("`account` or `organization` must be specified")
 
-    published = lambda_client.publish_layer_version(
-        LayerName=layer,
-        Description=version,
-        Content={"ZipFile": package.read_bytes()},
-        CompatibleRuntimes=runtimes,
+    return _publish_package(
+        boto_session,
+        layer,
+        version,
+        package,
+        runtimes,
+        account,
+        organization,
+        staging_bucket,
     )
 
+
+def _publish_package(
+    boto_session,
+    layer: str,
+    version: str,
+    package: Path,
+    runtimes: List[str],
+    account: str,
+    organization: Optional[str] = None,
+    staging_bucket: Optional[str] = None,
+) -> Dict[str, Any]:
+    lambda_client = _client(boto_session, "lambda")
+
+    if staging_bucket:
+        bucket, key = _upload_package_to_s3(boto_session, package, staging_bucket)
+        logger.info("Staged %s package at s3://%s/%s", layer, bucket, key)
+
+        try:
+            published = lambda_client.publish_layer_version(
+                LayerName=layer,
+                Description=version,
+                Content={"S3Bucket": bucket, "S3Key": key},
+                CompatibleRuntimes=runtimes,
+            )
+        finally:
+            _delete_staged_package(boto_session, bucket, key)
+    else:
+        # botocore base64-encodes the zip straight from the page cache, rather than
+        # from a copy of it read into memory
+        with package.open("rb") as package_file, mmap.mmap(
+            package_file.fileno(), 0, access=mmap.ACCESS_READ
+        ) as package_bytes:
+            published = lambda_client.publish_layer_version(
+                LayerName=layer,
+                Description=version,
+                Content={"ZipFile": package_bytes},
+                CompatibleRuntimes=runtimes,
+            )
+
     version_arn = published["LayerVersionArn"]
 
-    logger.info(f"Published version '{version}' of layer '{layer}' at '{version_arn}'")
+    logger.info(
+        "Published version '%s' of layer '%s' at '%s'", version, layer, version_arn
+    )
 
     permission_statement = lambda_client.add_layer_version_permission(  # noqa: F841
         LayerName=published["LayerArn"],
@@ -321,10 +640,12 @@ def publish_layer(
     )
 
     if organization:
-        logger.info(f"Allowed organization '{organization}' to access '{version_arn}'")
+        logger.info(
+            "Allowed organization '%s' to access '%s'", organization, version_arn
+        )
     elif account == "*":
-        logger.info(f"Allowed anyone to access '{version_arn}'")
+        logger.info("Allowed anyone to access '%s'", version_arn)
     else:
-        logger.info(f"Allowed account '{account}' to access '{version_arn}'")
+        logger.info("Allowed account '%s' to access '%s'", account, version_arn)
 
     return published
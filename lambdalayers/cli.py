@@ -1,24 +1,109 @@
 import argparse
 import logging
+import sys
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from functools import lru_cache, partial
 from pathlib import Path
 
-import boto3
-
 from lambdalayers import api
 
 
 logger = api.logger
 
+# the largest page the Lambda list APIs will return
+MAX_PAGE_SIZE = 50
+
+SUBCOMMANDS = {
+    "list": "List all available layers",
+    "versions": "List all available versions of a layer",
+    "publish": "Publish a new version of a layer",
+}
+
+
+def _print_all(batches) -> bool:
+    # write each batch (a page, or a region's layers) as soon as it arrives, with one
+    # write call rather than one per item
+    any_found = False
+
+    for batch in batches:
+        if batch:
+            any_found = True
+            sys.stdout.write("".join(f"{item}\n" for item in batch))
+            sys.stdout.flush()
+
+    return any_found
+
+
+def _positive_int(value: str) -> int:
+    try:
+        number = int(value)
+    except ValueError:
+        number = 0
+
+    if number < 1:
+        raise argparse.ArgumentTypeError(f"must be a positive integer, not {value}")
+
+    return number
+
+
+def _page_size(value: str) -> int:
+    number = _positive_int(value)
+    if number > MAX_PAGE_SIZE:
+        raise argparse.ArgumentTypeError(
+            f"must be at most {MAX_PAGE_SIZE}, not {value}"
+        )
+
+    return number
+
+
+@lru_cache(maxsize=8)
+def _get_session(profile, region):
+    # creating a session loads botocore's data files, so reuse them within a process
+    import boto3
+
+    return boto3.session.Session(profile_name=profile, region_name=region)
+
+
+def _list_region_layers(sessions, max_workers, runtime, max_items, page_size):
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = [
+            executor.submit(
+                lambda s: list(api.list_layers(s, runtime, max_items, page_size)),
+                session,
+            )
+            for session in sessions
+        ]
+
+        # yield each region's layers as soon as it has been listed, stopping once
+        # max_items have been listed across all of the regions
+        remaining = max_items
+        for future in as_completed(futures):
+            layers = future.result()
+            if remaining is not None:
+                layers = layers[:remaining]
+                remaining -= len(layers)
+
+            yield layers
+
+            if remaining == 0:
+                for pending in futures:
+                    pending.cancel()
+                return
+
 
 def main(args=None):
     args = parse_args(args=args)
 
-    logging.basicConfig(level=args.log_level)
+    # leave logging alone if the host application has already configured it; the
+    # package logger's level is all we need to control
+    if not logging.getLogger().handlers:
+        logging.basicConfig(level=args.log_level)
     logger.setLevel(args.log_level)
 
-    session = boto3.session.Session(profile_name=args.profile, region_name=args.region)
+    session = _get_session(args.profile, args.region)
+    regions = getattr(args, "regions", None)
 
-    if session.region_name is None:
+    if session.region_name is None and not regions:
         logger.error(
             "No default region exists for your AWS profile. "
             "Please specify one manually by passing `--region REGION_NAME`."
@@ -26,42 +111,45 @@ def main(args=None):
         exit(1)
 
     if args.command == "list":
-        layers = api.list_layers(session, args.runtime)
-        any_found = False
-
-        for layer in layers:
-            any_found = True
-            print(layer)
-
-        if not any_found:
+        if regions:
+            # sessions aren't thread-safe, so use one per (distinct) region
+            region_sessions = [
+                _get_session(args.profile, region) for region in dict.fromkeys(regions)
+            ]
+            max_workers = args.max_workers
+            if max_workers is None:
+                max_workers = min(32, len(region_sessions))
+
+            layers = _list_region_layers(
+                region_sessions,
+                max_workers,
+                args.runtime,
+                args.max_items,
+                args.page_size,
+            )
+        else:
+            layers = api._layer_pages(
+                session, args.runtime, args.max_items, args.page_size
+            )
+        if not _print_all(layers):
             if args.runtime:
-                logger.info(f"No layers found supporting '{args.runtime}'")
+                logger.info("No layers found supporting '%s'", args.runtime)
             else:
                 logger.info("No layers found")
     elif args.command == "versions":
-        versions = api.list_versions(session, args.layer, args.runtime)
-        any_found = False
-
-        for layer in versions:
-            any_found = True
-            print(layer)
-
-        if not any_found:
+        versions = api._version_pages(
+            session, args.layer, args.runtime, args.max_items, args.page_size
+        )
+        if not _print_all(versions):
             if args.runtime:
                 logger.info(
-                    f"No versions found for layer '{args.layer}' supporting '{args.runtime}"  # noqa: E501
+                    "No versions found for layer '%s' supporting '%s'",
+                    args.layer,
+                    args.runtime,
                 )
             else:
-                logger.info(f"No versions found for layer '{args.layer}'")
+                logger.info("No versions found for layer '%s'", args.layer)
     elif args.command == "publish":
-        account, organization = api._permission_ids(
-            session,
-            args.account,
-            args.organization,
-            args.my_account,
-            args.my_organization,
-        )
-
         print(
             api.publish_layer(
                 session,
@@ -70,8 +158,19 @@ def main(args=None):
                 args.layer_path,
                 None,
                 args.runtimes,
-                account,
-                organization,
+                args.account,
+                args.organization,
+                staging_bucket=args.staging_bucket,
+                reuse_builds=args.reuse_builds,
+                # look up the permission ids while the layer builds
+                permission_ids=partial(
+                    api._permission_ids,
+                    session,
+                    args.account,
+                    args.organization,
+                    args.my_account,
+                    args.my_organization,
+                ),
             )
         )
 
@@ -82,28 +181,40 @@ def parse_args(args=None):
     )
 
     subparsers = parser.add_subparsers(dest="command", help="Subcommand help")
-    subparsers.add_parser("list", help="List all available layers")
-    subparsers.add_parser("versions", help="List all available versions of a layer")
-    subparsers.add_parser("publish", help="Publish a new version of a layer")
-
-    for name, subparser in subparsers.choices.items():
-        subparser.add_argument(
-            "--region",
-            default=None,
-            help=(
-                "The AWS region to use. "
-                "If not given, deploy will fall back to config/env settings."
-            ),
-        )
-        subparser.add_argument(
-            "--profile",
-            default=None,
-            help=(
-                "The AWS profile to use. "
-                "If not given, deploy will fall back to config/env settings."
-            ),
+
+    if args is None:
+        args = sys.argv[1:]
+
+    # only build the invoked subcommand's parser; build them all for top-level help
+    # and invalid commands
+    selected = args[:1] if args and args[0] in SUBCOMMANDS else list(SUBCOMMANDS)
+
+    # arguments shared by every subcommand
+    common = argparse.ArgumentParser(add_help=False)
+    common.add_argument(
+        "--region",
+        default=None,
+        help=(
+            "The AWS region to use. "
+            "If not given, deploy will fall back to config/env settings."
+        ),
+    )
+    common.add_argument(
+        "--profile",
+        default=None,
+        help=(
+            "The AWS profile to use. "
+            "If not given, deploy will fall back to config/env settings."
+        ),
+    )
+
+    for name in selected:
+        subparser = subparsers.add_parser(
+            name, parents=[common], help=SUBCOMMANDS[name]
         )
 
+        # parents don't keep a mutually exclusive group inside its argument group,
+        # so the logging arguments are added here to keep their help section
         logger_group_parent = subparser.add_argument_group(
             title="logging arguments",
             description="Control what log level the log outputs (default: logger.INFO)",
@@ -133,7 +244,10 @@ def parse_args(args=None):
 
         if name == "publish":
             subparser.add_argument(
-                "--layer-path", type=Path, help="Directory containing a layer"
+                "--layer-path",
+                type=Path,
+                required=True,
+                help="Directory containing a layer",
             )
 
             subparser.add_argument(
@@ -151,6 +265,25 @@ def parse_args(args=None):
                 "--version", default="", help="Layer version to publish"
             )
 
+            subparser.add_argument(
+                "--staging-bucket",
+                default=None,
+                help=(
+                    "Upload the layer zip to this S3 bucket before publishing, "
+                    "instead of sending it with the request (needed for large layers)"
+                ),
+            )
+
+            subparser.add_argument(
+                "--reuse-builds",
+                action="store_true",
+                help=(
+                    "Reuse each runtime's build from the last publish if the layer's "
+                    "files and requirements file are unchanged (unpinned "
+                    "requirements won't be upgraded)"
+                ),
+            )
+
             permissions_group_parent = subparser.add_argument_group(
                 title="layer permissions",
                 description=(
@@ -190,11 +323,50 @@ def parse_args(args=None):
                 default=None,
                 help="Lambda runtime (e.g., `python3.7`) to filter by",
             )
+            subparser.add_argument(
+                "--max-items",
+                type=_positive_int,
+                default=None,
+                help="Stop after listing this many items",
+            )
+            subparser.add_argument(
+                "--page-size",
+                type=_page_size,
+                default=None,
+                help=(
+                    "The number of items to request from AWS at a time "
+                    f"(up to {MAX_PAGE_SIZE})"
+                ),
+            )
+
+        if name == "list":
+            subparser.add_argument(
+                "--regions",
+                nargs="+",
+                default=None,
+                help="List layers from each of these AWS regions concurrently",
+            )
+            subparser.add_argument(
+                "--max-workers",
+                type=_positive_int,
+                default=None,
+                help=(
+                    "The maximum number of regions to list concurrently "
+                    "(default: the number of regions, up to 32)"
+                ),
+            )
 
         if name != "list":
             subparser.add_argument("--layer", help="Name of the layer")
 
-    return parser.parse_args(args)
+    parsed = parser.parse_args(args)
+
+    # exit before main() creates an AWS session (`add_subparsers(required=True)`
+    # needs Python 3.7)
+    if parsed.command is None:
+        parser.error("a subcommand is required")
+
+    return parsed
 
 
 if __name__ == "__main__":
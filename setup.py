@@ -1,6 +1,6 @@
 from os.path import abspath, dirname, join
 
-from setuptools import find_packages, setup
+from setuptools import setup
 
 
 TEST_DEPS = ["coverage", "pytest", "pytest-cov", "requests"]
@@ -21,18 +21,19 @@ EXTRAS = {
     "dev": TEST_DEPS + CHECK_DEPS,
 }
 
-# Read in the version
-with open(join(dirname(abspath(__file__)), "VERSION")) as version_file:
-    version = version_file.read().strip()
+
+def _version():
+    with open(join(dirname(abspath(__file__)), "VERSION")) as version_file:
+        return version_file.read().strip()
 
 
 setup(
     name="lambdalayers",
-    version=version,
+    version=_version(),
     description="Some useful AWS Lambda layers for Invenia (and code to deploy them)",
     author="Invenia Technical Computing",
     url="https://gitlab.invenia.ca/infrastructure/lambdalayers",
-    packages=find_packages(exclude=["tests"]),
+    packages=["lambdalayers"],
     install_requires=REQUIREMENTS,
     tests_require=TEST_DEPS,
     extras_require=EXTRAS,
@@ -1,39 +1,85 @@
 import json
+import logging
 import os
 import shutil
+import sys
 import tempfile
+import time
 import uuid
 import zipfile
+from concurrent.futures import ThreadPoolExecutor
 from contextlib import contextmanager
 from io import BytesIO
 from pathlib import Path
+from types import SimpleNamespace
 
 import boto3
 import docker
 import pytest
 import requests
+from botocore.config import Config
+from botocore.exceptions import ClientError
+from botocore.stub import ANY, Stubber
 
 import lambdalayers
 from lambdalayers.api import (
+    _client,
+    _merge_runtime_zips,
     _permission_ids,
+    _prefetched,
+    _publish_package,
     _read_local_layer,
     build_layer,
     list_layers,
     list_versions,
     publish_layer,
 )
+from lambdalayers.cli import _list_region_layers, _print_all, parse_args
 
 
 DIR = Path(__file__).resolve().parent
 STACKNAME = os.getenv("STACKNAME")
 
+# a stubbed publish_layer_version response
+STUB_PUBLISHED = {
+    "LayerArn": "arn:aws:lambda:us-east-1:123456789012:layer:TestLayer",
+    "LayerVersionArn": "arn:aws:lambda:us-east-1:123456789012:layer:TestLayer:1",
+    "Version": 1,
+}
+
 
 def layer_names(layers, prefix=""):
+    # prefix may also be a tuple of prefixes, as with str.startswith
+    if not prefix:
+        return [layer["LayerName"] for layer in layers]
+
     return [
         layer["LayerName"] for layer in layers if layer["LayerName"].startswith(prefix)
     ]
 
 
+def zip_has(layer_zip, name):
+    # look the entry up directly rather than building a list of every name
+    try:
+        layer_zip.getinfo(name)
+    except KeyError:
+        return False
+
+    return True
+
+
+def write_runtime_zip(path, runtime):
+    # a stand-in for a per-runtime zip built by plz
+    with zipfile.ZipFile(path, "w", zipfile.ZIP_DEFLATED) as z:
+        z.writestr(zipfile.ZipInfo("python/pkg/"), b"")
+        for name, mode in [("pkg/__init__.py", 0o644), ("pkg/run.sh", 0o755)]:
+            info = zipfile.ZipInfo(f"python/{name}")
+            info.create_system = 3  # unix, so the mode below is honoured
+            info.external_attr = (0o100000 | mode) << 16
+            z.writestr(info, f"# {runtime}\n")
+    return path
+
+
 @contextmanager
 def public_tmp_dir(parent):
     tmpdir = Path(parent) / uuid.uuid4().hex
@@ -51,22 +97,119 @@ def build_dir():
     shutil.rmtree(build_dir, ignore_errors=True)
 
 
+@pytest.fixture
+def fake_plz(monkeypatch):
+    # record the runtimes plz builds for, without pip installing anything
+    calls = []
+
+    def build_zip(build_path, *files, requirements=None, python_version, **kwargs):
+        calls.append(python_version)
+        build_path.mkdir(parents=True, exist_ok=True)
+        return write_runtime_zip(build_path / "package.zip", python_version)
+
+    monkeypatch.setitem(sys.modules, "plz", SimpleNamespace(build_zip=build_zip))
+    return calls
+
+
+@pytest.fixture
+def local_layer(build_dir):
+    local_path = build_dir / "layer"
+    shutil.copytree(
+        DIR / "test_layer", local_path, ignore=shutil.ignore_patterns(".build")
+    )
+    return local_path
+
+
+@pytest.fixture
+def stubbed_session():
+    # a session whose Lambda and S3 clients only answer with stubbed responses
+    session = boto3.session.Session(
+        aws_access_key_id="testing",
+        aws_secret_access_key="testing",
+        region_name="us-east-1",
+    )
+    lambda_stub = Stubber(_client(session, "lambda"))
+    s3_stub = Stubber(_client(session, "s3"))
+
+    with lambda_stub, s3_stub:
+        yield session, lambda_stub, s3_stub
+
+    lambda_stub.assert_no_pending_responses()
+    s3_stub.assert_no_pending_responses()
+
+
+@pytest.fixture
+def fake_regions(monkeypatch):
+    # "sessions" are (region, delay, number of layers) tuples; record which regions
+    # were started
+    started = []
+
+    def list_layers(session, runtime=None, max_items=None, page_size=None):
+        region, delay, count = session
+        started.append(region)
+        time.sleep(delay)
+        return [f"{region}-{i}" for i in range(count)][:max_items]
+
+    monkeypatch.setattr("lambdalayers.api.list_layers", list_layers)
+    return started
+
+
+@pytest.fixture(scope="session")
+def aws_identity():
+    session = boto3.session.Session()
+    return {
+        "account": session.client("sts").get_caller_identity()["Account"],
+        "organization": session.client("organizations").describe_organization()[
+            "Organization"
+        ]["Id"],
+    }
+
+
 @pytest.fixture
 def layer_cleanup():
     yield None
     session = boto3.session.Session()
-    client = session.client("lambda")
+    # enough connections for the cleanup threads, backing off if Lambda throttles them
+    config = Config(
+        max_pool_connections=32, retries={"max_attempts": 10, "mode": "adaptive"}
+    )
+    client = session.client("lambda", config=config)
     layers = list_layers(session)
 
-    for layer in layers:
-        layer_name = layer["LayerName"]
-        if layer_name.startswith((f"{STACKNAME}-TestLayer", "None-TestLayer")):
-            versions = list_versions(session, layer["LayerArn"])
-            for version in versions:
-                print(f"deleting {layer_name}:{version}")
-                client.delete_layer_version(
-                    LayerName=layer_name, VersionNumber=version["Version"]
-                )
+    # sort the delete targets by layer name
+    matched = sorted(
+        (
+            layer
+            for layer in layers
+            if layer["LayerName"].startswith(
+                (f"{STACKNAME}-TestLayer", "None-TestLayer")
+            )
+        ),
+        key=lambda layer: layer["LayerName"],
+    )
+
+    def delete_layer_version(layer_version):
+        layer_name, version = layer_version
+        print(f"deleting {layer_name}:{version}")
+        client.delete_layer_version(
+            LayerName=layer_name, VersionNumber=version["Version"]
+        )
+
+    # the listing threads share the session, and session.client() isn't thread-safe,
+    # so create the cached Lambda client list_versions uses before fanning out
+    _client(session, "lambda")
+
+    # the listing and deleting requests are independent, so send them concurrently
+    with ThreadPoolExecutor(max_workers=16) as executor:
+        versions_by_layer = executor.map(
+            lambda layer: list(list_versions(session, layer["LayerArn"])), matched
+        )
+        layer_versions = [
+            (layer["LayerName"], version)
+            for layer, versions in zip(matched, versions_by_layer)
+            for version in versions
+        ]
+        list(executor.map(delete_layer_version, layer_versions))
 
 
 class TestUtils(object):
@@ -75,12 +218,10 @@ class TestUtils(object):
         assert hasattr(lambdalayers, "__version__")
 
     @pytest.mark.aws
-    def test_permission_ids(self):
+    def test_permission_ids(self, aws_identity):
         session = boto3.session.Session()
-        my_organization = session.client("organizations").describe_organization()[
-            "Organization"
-        ]["Id"]
-        my_account = session.client("sts").get_caller_identity()["Account"]
+        my_organization = aws_identity["organization"]
+        my_account = aws_identity["account"]
         assert _permission_ids(session, "123", None, False, False) == ("123", None)
         assert _permission_ids(session, "123", "123", False, False) == ("*", "123")
         assert _permission_ids(session, None, None, True, False) == (my_account, None)
@@ -91,15 +232,136 @@ class TestUtils(object):
         with pytest.raises(ValueError):
             _permission_ids(session, None, None, False, False)
 
+    def test_prefetched(self):
+        pages = [{"Layers": [i]} for i in range(5)]
+        assert list(_prefetched(iter(pages))) == pages
+        assert list(_prefetched(iter([]))) == []
+
+    def test_prefetched_error(self):
+        def pages():
+            yield {"Layers": [0]}
+            raise RuntimeError("throttled")
+
+        prefetched = _prefetched(pages())
+        assert next(prefetched) == {"Layers": [0]}
+        with pytest.raises(RuntimeError, match="throttled"):
+            next(prefetched)
+
+    def test_prefetched_stop_early(self):
+        fetched = []
+
+        def pages():
+            for i in range(5):
+                fetched.append(i)
+                yield {"Layers": [i]}
+
+        prefetched = _prefetched(pages())
+        assert next(prefetched) == {"Layers": [0]}
+        prefetched.close()
+        # at most the page after the one consumed is fetched ahead
+        assert len(fetched) <= 2
+
+    def test_parse_args_list(self):
+        assert vars(parse_args(["list", "--runtime", "python3.7", "-d"])) == {
+            "command": "list",
+            "region": None,
+            "profile": None,
+            "log_level": logging.DEBUG,
+            "runtime": "python3.7",
+            "max_items": None,
+            "page_size": None,
+            "regions": None,
+            "max_workers": None,
+        }
+
+    def test_parse_args_publish(self):
+        args = parse_args(
+            [
+                "publish",
+                "--layer",
+                "pg8000",
+                "--layer-path",
+                "layers/pg8000",
+                "--runtimes",
+                "python3.7",
+                "python3.8",
+                "--my-organization",
+            ]
+        )
+        assert args.command == "publish"
+        assert args.layer == "pg8000"
+        assert args.layer_path == Path("layers/pg8000")
+        assert args.runtimes == ["python3.7", "python3.8"]
+        assert args.my_organization
+        assert not args.my_account
+        assert args.account is None
+        assert args.log_level == logging.INFO
+        assert not hasattr(args, "runtime")
+
+    def test_print_all(self, capsys):
+        assert _print_all(iter([["a", "b"], [], ["c"]]))
+        assert capsys.readouterr().out == "a\nb\nc\n"
+        assert not _print_all(iter([[]]))
+        assert capsys.readouterr().out == ""
+
+    @pytest.mark.parametrize("max_workers", ["0", "-1", "one"])
+    def test_parse_args_invalid_max_workers(self, max_workers):
+        with pytest.raises(SystemExit) as exc_info:
+            parse_args(["list", "--regions", "us-east-1", "--max-workers", max_workers])
+        assert exc_info.value.code == 2
+
+    @pytest.mark.parametrize(
+        "args",
+        [
+            ["--max-items", "0"],
+            ["--max-items", "-1"],
+            ["--page-size", "0"],
+            ["--page-size", "51"],
+        ],
+    )
+    def test_parse_args_invalid_limits(self, args):
+        for command in ["list", "versions"]:
+            with pytest.raises(SystemExit) as exc_info:
+                parse_args([command, *args])
+            assert exc_info.value.code == 2
+
+        assert parse_args(["list", "--max-items", "1", "--page-size", "50"])
+
+    @pytest.mark.parametrize("args", [[], ["unknown"]])
+    def test_parse_args_invalid_command(self, args):
+        with pytest.raises(SystemExit) as exc_info:
+            parse_args(args)
+        assert exc_info.value.code == 2
+
+    def test_list_region_layers(self, fake_regions):
+        sessions = [("a", 0.4, 2), ("b", 0, 2), ("c", 0.2, 1)]
+        batches = list(_list_region_layers(sessions, 3, None, None, None))
+        # each region's layers arrive as soon as that region has been listed
+        assert batches == [["b-0", "b-1"], ["c-0"], ["a-0", "a-1"]]
+
+    def test_list_region_layers_max_items(self, fake_regions):
+        sessions = [("a", 0, 2), ("b", 0.2, 2), ("c", 0.4, 2)]
+        batches = list(_list_region_layers(sessions, 3, None, 3, None))
+        assert batches == [["a-0", "a-1"], ["b-0"]]
+
+    def test_list_region_layers_cancel(self, fake_regions):
+        sessions = [("a", 0, 2), ("b", 0.4, 2), ("c", 0, 2)]
+        batches = list(_list_region_layers(sessions, 1, None, 2, None))
+        assert batches == [["a-0", "a-1"]]
+        # "b" may have started before "a" was listed, but "c" is cancelled
+        assert "c" not in fake_regions
+
     def test_read_local_layer(self):
         local_path = DIR / "test_layer"
-        files, requirements_file = _read_local_layer(DIR / "test_layer")
-        assert local_path / Path(".build/package/foo.py") not in files
-        assert local_path / Path("requirements.txt") not in files
-        assert local_path / Path("foo.py") in files
-        assert local_path / Path("bar") in files
+        files, requirements_file = _read_local_layer(local_path)
+        local_dir = str(local_path)
+        file_strs = {str(path) for path in files}
+        assert os.path.join(local_dir, ".build", "package", "foo.py") not in file_strs
+        assert os.path.join(local_dir, "requirements.txt") not in file_strs
+        assert os.path.join(local_dir, "foo.py") in file_strs
+        assert os.path.join(local_dir, "bar") in file_strs
         assert len(files) == 2
-        assert requirements_file == local_path / Path("requirements.txt")
+        assert str(requirements_file) == os.path.join(local_dir, "requirements.txt")
 
 
 class TestLayers(object):
@@ -107,11 +369,10 @@ class TestLayers(object):
     def test_build_single_runtime(self, build_dir):
         package = build_layer(DIR / "test_layer", ["python3.7"], build_dir)
         with zipfile.ZipFile(package) as layer_zip:
-            layer_file_set = frozenset(layer_zip.namelist())
-            assert "python/foo.py" in layer_file_set
-            assert "python/bar/__init__.py" in layer_file_set
-            assert "python/requirements.txt" not in layer_file_set
-            assert "python/scrapy/__init__.py" in layer_file_set
+            assert zip_has(layer_zip, "python/foo.py")
+            assert zip_has(layer_zip, "python/bar/__init__.py")
+            assert not zip_has(layer_zip, "python/requirements.txt")
+            assert zip_has(layer_zip, "python/scrapy/__init__.py")
 
     @pytest.mark.xfail
     def test_build_compat_runtime(self, build_dir):
@@ -119,11 +380,10 @@ class TestLayers(object):
             DIR / "test_compat_layer", ["python3.7", "python3.8"], build_dir
         )
         with zipfile.ZipFile(package) as layer_zip:
-            layer_file_set = frozenset(layer_zip.namelist())
-            assert "python/foo.py" in layer_file_set
-            assert "python/bar/__init__.py" in layer_file_set
-            assert "python/requirements.txt" not in layer_file_set
-            assert "python/pg8000/__init__.py" in layer_file_set
+            assert zip_has(layer_zip, "python/foo.py")
+            assert zip_has(layer_zip, "python/bar/__init__.py")
+            assert not zip_has(layer_zip, "python/requirements.txt")
+            assert zip_has(layer_zip, "python/pg8000/__init__.py")
 
     @pytest.mark.xfail
     def test_build_multi_runtime(self, build_dir):
@@ -131,22 +391,232 @@ class TestLayers(object):
             DIR / "test_multi_layer", ["python3.7", "python3.8"], build_dir
         )
         with zipfile.ZipFile(package) as layer_zip:
-            layer_file_set = frozenset(layer_zip.namelist())
-            assert "python/psycopg2/__init__.py" not in layer_file_set
-            assert "python/requirements.txt" not in layer_file_set
+            assert not zip_has(layer_zip, "python/psycopg2/__init__.py")
+            assert not zip_has(layer_zip, "python/requirements.txt")
             python37_dir = "python/lib/python3.7/site-packages"
             python38_dir = "python/lib/python3.8/site-packages"
-            assert f"{python37_dir}/psycopg2/__init__.py" in layer_file_set
-            assert f"{python38_dir}/psycopg2/__init__.py" in layer_file_set
-            assert (
-                f"{python37_dir}/psycopg2/_psycopg.cpython-37m-x86_64-linux-gnu.so"
-                in layer_file_set
+            assert zip_has(layer_zip, f"{python37_dir}/psycopg2/__init__.py")
+            assert zip_has(layer_zip, f"{python38_dir}/psycopg2/__init__.py")
+            assert zip_has(
+                layer_zip,
+                f"{python37_dir}/psycopg2/_psycopg.cpython-37m-x86_64-linux-gnu.so",
+            )
+            assert zip_has(
+                layer_zip,
+                f"{python38_dir}/psycopg2/_psycopg.cpython-38m-x86_64-linux-gnu.so",
+            )
+
+    def test_build_without_reuse(self, build_dir, fake_plz, local_layer):
+        build_layer(local_layer, ["python3.7"], build_dir / "build")
+        build_layer(local_layer, ["python3.7"], build_dir / "build")
+        assert fake_plz == ["3.7", "3.7"]
+
+    def test_build_reuse(self, build_dir, fake_plz, local_layer):
+        first = build_layer(
+            local_layer, ["python3.7"], build_dir / "build", reuse_builds=True
+        )
+        second = build_layer(
+            local_layer, ["python3.7"], build_dir / "build", reuse_builds=True
+        )
+        assert fake_plz == ["3.7"]
+        assert first == second
+
+    @pytest.mark.parametrize(
+        "changed", ["foo.py", "bar/__init__.py", "requirements.txt"]
+    )
+    def test_build_reuse_changed(self, build_dir, fake_plz, local_layer, changed):
+        build_layer(local_layer, ["python3.7"], build_dir / "build", reuse_builds=True)
+        with (local_layer / changed).open("a") as changed_file:
+            changed_file.write("\n# changed\n")
+
+        build_layer(local_layer, ["python3.7"], build_dir / "build", reuse_builds=True)
+        assert fake_plz == ["3.7", "3.7"]
+
+    def test_build_reuse_other_runtime(self, build_dir, fake_plz, local_layer):
+        build_layer(local_layer, ["python3.7"], build_dir / "build", reuse_builds=True)
+        build_layer(local_layer, ["python3.8"], build_dir / "build", reuse_builds=True)
+        assert fake_plz == ["3.7", "3.8"]
+
+    @pytest.mark.parametrize("in_memory", [True, False])
+    @pytest.mark.parametrize(
+        "compresslevel",
+        [
+            None,
+            pytest.param(
+                9,
+                marks=pytest.mark.skipif(
+                    sys.version_info < (3, 7), reason="needs ZipFile compresslevel"
+                ),
+            ),
+        ],
+    )
+    def test_merge_runtime_zips(self, build_dir, in_memory, compresslevel):
+        runtimes = ["python3.7", "python3.8"]
+        package_zips = [
+            write_runtime_zip(build_dir / f"{runtime}.zip", runtime)
+            for runtime in runtimes
+        ]
+
+        dest = BytesIO() if in_memory else build_dir / "package.zip"
+        _merge_runtime_zips(dest, package_zips, runtimes, compresslevel)
+
+        with zipfile.ZipFile(dest) as layer_zip:
+            assert layer_zip.testzip() is None
+            assert len(layer_zip.infolist()) == 6
+            for runtime in runtimes:
+                prefix = f"python/lib/{runtime}/site-packages/pkg/"
+                assert layer_zip.getinfo(prefix).is_dir()
+
+                for name, mode in [("__init__.py", 0o644), ("run.sh", 0o755)]:
+                    info = layer_zip.getinfo(prefix + name)
+                    assert info.external_attr >> 16 == 0o100000 | mode
+                    assert layer_zip.read(info) == f"# {runtime}\n".encode()
+
+    def test_publish_staged(self, build_dir, stubbed_session):
+        session, lambda_stub, s3_stub = stubbed_session
+        package = write_runtime_zip(build_dir / "package.zip", "python3.7")
+
+        s3_stub.add_response("put_object", {})
+        lambda_stub.add_response(
+            "publish_layer_version",
+            STUB_PUBLISHED,
+            {
+                "LayerName": "TestLayer",
+                "Description": "v1",
+                "Content": {"S3Bucket": "staging", "S3Key": ANY},
+                "CompatibleRuntimes": ["python3.7"],
+            },
+        )
+        s3_stub.add_response("delete_object", {}, {"Bucket": "staging", "Key": ANY})
+        lambda_stub.add_response("add_layer_version_permission", {})
+
+        assert (
+            _publish_package(
+                session,
+                "TestLayer",
+                "v1",
+                package,
+                ["python3.7"],
+                "123",
+                None,
+                "staging",
+            )
+            == STUB_PUBLISHED
+        )
+
+    def test_publish_staged_error(self, build_dir, stubbed_session):
+        session, lambda_stub, s3_stub = stubbed_session
+        package = write_runtime_zip(build_dir / "package.zip", "python3.7")
+
+        s3_stub.add_response("put_object", {})
+        lambda_stub.add_client_error("publish_layer_version", "InvalidParameterValue")
+        s3_stub.add_response("delete_object", {}, {"Bucket": "staging", "Key": ANY})
+
+        # the staged package is still deleted
+        with pytest.raises(ClientError, match="InvalidParameterValue"):
+            _publish_package(
+                session,
+                "TestLayer",
+                "v1",
+                package,
+                ["python3.7"],
+                "123",
+                None,
+                "staging",
             )
+
+    def test_publish_staged_cleanup_error(self, build_dir, stubbed_session, caplog):
+        session, lambda_stub, s3_stub = stubbed_session
+        package = write_runtime_zip(build_dir / "package.zip", "python3.7")
+
+        s3_stub.add_response("put_object", {})
+        lambda_stub.add_response("publish_layer_version", STUB_PUBLISHED)
+        s3_stub.add_client_error("delete_object", "AccessDenied")
+        lambda_stub.add_response("add_layer_version_permission", {})
+
+        with caplog.at_level(logging.WARNING, logger="lambdalayers.api"):
             assert (
-                f"{python38_dir}/psycopg2/_psycopg.cpython-38m-x86_64-linux-gnu.so"
-                in layer_file_set
+                _publish_package(
+                    session,
+                    "TestLayer",
+                    "v1",
+                    package,
+                    ["python3.7"],
+                    "123",
+                    None,
+                    "staging",
+                )
+                == STUB_PUBLISHED
             )
 
+        assert any(
+            record.levelno == logging.WARNING and "AccessDenied" in record.getMessage()
+            for record in caplog.records
+        )
+
+    @pytest.mark.skipif(sys.version_info < (3, 7), reason="needs ZipFile compresslevel")
+    def test_merge_runtime_zips_compresslevel(self, build_dir):
+        # compresses noticeably better at level 9 than at level 1 (or the default)
+        data = "".join(str(i * i % 9973) for i in range(50000)).encode()
+        runtimes = ["python3.7", "python3.8"]
+        package_zips = []
+        for runtime in runtimes:
+            package_zip = build_dir / f"{runtime}.zip"
+            with zipfile.ZipFile(package_zip, "w", zipfile.ZIP_DEFLATED) as z:
+                z.writestr("python/data.txt", data)
+            package_zips.append(package_zip)
+
+        compress_sizes = {}
+        for compresslevel in [1, 9]:
+            dest = BytesIO()
+            _merge_runtime_zips(dest, package_zips, runtimes, compresslevel)
+            with zipfile.ZipFile(dest) as layer_zip:
+                info = layer_zip.getinfo("python/lib/python3.7/site-packages/data.txt")
+                assert layer_zip.read(info) == data
+                compress_sizes[compresslevel] = info.compress_size
+
+        assert compress_sizes[9] < compress_sizes[1]
+
+    def test_publish_permission_ids(
+        self, build_dir, fake_plz, local_layer, stubbed_session
+    ):
+        session, lambda_stub, s3_stub = stubbed_session
+        lambda_stub.add_response(
+            "publish_layer_version",
+            STUB_PUBLISHED,
+            {
+                "LayerName": "TestLayer",
+                "Description": "v1",
+                "Content": {"ZipFile": ANY},
+                "CompatibleRuntimes": ["python3.7"],
+            },
+        )
+        lambda_stub.add_response(
+            "add_layer_version_permission",
+            {},
+            {
+                "LayerName": STUB_PUBLISHED["LayerArn"],
+                "VersionNumber": 1,
+                "Action": "lambda:GetLayerVersion",
+                "StatementId": "LayerVersionPermission",
+                "Principal": "*",
+                "OrganizationId": "o-test",
+            },
+        )
+
+        published = publish_layer(
+            session,
+            "TestLayer",
+            "v1",
+            local_layer,
+            build_dir / "build",
+            ["python3.7"],
+            None,
+            permission_ids=lambda: ("*", "o-test"),
+        )
+        assert published == STUB_PUBLISHED
+        assert fake_plz == ["3.7"]
+
     @pytest.mark.xfail
     def test_run_lambda(self, build_dir):
         runtimes = ["python3.7", "python3.8", "python3.9"]
@@ -156,7 +626,8 @@ class TestLayers(object):
             with zipfile.ZipFile(package) as z:
                 z.extractall(tmp_dir)
 
-            for runtime in runtimes:
+            def run_lambda(runtime):
+                # a client per thread, rather than sharing one's connection pool
                 client = docker.from_env()
                 output_bytes = client.containers.run(
                     f"lambci/lambda:{runtime}",
@@ -173,9 +644,14 @@ class TestLayers(object):
                     ],
                     command="lambda_function.lambda_handler",
                 )
-                output = json.loads(output_bytes)
-                assert any(runtime in path for path in output["psycopg2"])
-                assert output["libpq"] >= 100000
+                return json.loads(output_bytes)
+
+            with ThreadPoolExecutor(max_workers=len(runtimes)) as executor:
+                outputs = executor.map(run_lambda, runtimes)
+
+                for runtime, output in zip(runtimes, outputs):
+                    assert any(runtime in path for path in output["psycopg2"])
+                    assert output["libpq"] >= 100000
 
     @pytest.mark.aws
     @pytest.mark.xfail
@@ -198,21 +674,19 @@ class TestLayers(object):
         assert published["CompatibleRuntimes"] == ["python3.7"]
 
         # test local package.zip
-        layer_zip = zipfile.ZipFile(build_dir / "package.zip")
-        layer_file_set = frozenset(layer_zip.namelist())
-        assert "python/foo.py" in layer_file_set
-        assert "python/bar/__init__.py" in layer_file_set
-        assert "python/requirements.txt" not in layer_file_set
-        assert "python/scrapy/__init__.py" in layer_file_set
+        with zipfile.ZipFile(build_dir / "package.zip") as layer_zip:
+            assert zip_has(layer_zip, "python/foo.py")
+            assert zip_has(layer_zip, "python/bar/__init__.py")
+            assert not zip_has(layer_zip, "python/requirements.txt")
+            assert zip_has(layer_zip, "python/scrapy/__init__.py")
 
         # test remote zip
         resp = requests.get(published["Content"]["Location"])
-        layer_zip = zipfile.ZipFile(BytesIO(resp.content))
-        layer_file_set = frozenset(layer_zip.namelist())
-        assert "python/foo.py" in layer_file_set
-        assert "python/bar/__init__.py" in layer_file_set
-        assert "python/requirements.txt" not in layer_file_set
-        assert "python/scrapy/__init__.py" in layer_file_set
+        with zipfile.ZipFile(BytesIO(resp.content)) as layer_zip:
+            assert zip_has(layer_zip, "python/foo.py")
+            assert zip_has(layer_zip, "python/bar/__init__.py")
+            assert not zip_has(layer_zip, "python/requirements.txt")
+            assert zip_has(layer_zip, "python/scrapy/__init__.py")
 
         layers = list_layers(session)
         assert layer_names(layers) == [layer_name]